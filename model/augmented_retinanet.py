@@ -0,0 +1,36 @@
+import keras_cv
+from keras_cv import bounding_box
+
+
+class AugmentedRetinaNet(keras_cv.models.RetinaNet):
+    def __init__(
+        self,
+        augmenter,
+        max_boxes=32,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.augmenter = augmenter
+        self.max_boxes = max_boxes
+
+    def train_step(self, data):
+        """Applies the augmenter to a training batch before the RetinaNet training step.
+        Augmenting here rather than in the input pipeline runs it on the training device.
+
+        Args:
+            data: tuple of images with shape [batch, height, width, channels] and
+            their dense bounding boxes, padded with -1 up to max_boxes
+        """
+        images, bounding_boxes = data
+        augmented = self.augmenter(
+            {
+                "images": images,
+                "bounding_boxes": bounding_box.to_ragged(bounding_boxes),
+            },
+            training=True,
+        )
+        # The augmenter returns ragged bounding boxes, which are padded again for the label encoder
+        bounding_boxes = bounding_box.to_dense(
+            augmented["bounding_boxes"], max_boxes=self.max_boxes
+        )
+        return super().train_step((augmented["images"], bounding_boxes))
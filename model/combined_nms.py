@@ -38,28 +38,6 @@ class CombinedNMS(tf.keras.layers.Layer):
         box_prediction = tf.reshape(box_prediction, [-1, 4])
         class_predictions = tf.reshape(class_predictions, [-1, self.num_classes])
 
-        def nms_filtering_indices(scores):
-            # Based on the top scores, filter scores below the confidence threshold,
-            # Then, perform non-max suppression
-            indices = tf.where(
-                tf.keras.backend.greater(scores, self.confidence_threshold)
-            )
-
-            filtered_boxes = tf.gather_nd(box_prediction, indices)
-            filtered_scores = tf.gather(scores, indices)[:, 0]
-
-            # Perform NMS
-            nms_indices = tf.image.non_max_suppression(
-                filtered_boxes,
-                filtered_scores,
-                max_output_size=self.max_detections_per_class,
-                iou_threshold=self.iou_threshold,
-            )
-
-            # Filter indices based on NMS
-            indices = tf.gather(indices, nms_indices)
-            return indices
-
         # Always convert to bounding_box_format for RDK
         box_prediction = bounding_box.convert_format(
             box_prediction,
@@ -72,35 +50,31 @@ class CombinedNMS(tf.keras.layers.Layer):
         if self.from_logits:
             class_predictions = tf.math.sigmoid(class_predictions)
 
-        scores = tf.keras.backend.max(class_predictions, axis=1)
-        labels = tf.keras.backend.argmax(class_predictions, axis=1)
-        indices = nms_filtering_indices(scores)
-
-        # Filter labels and then class predictions on indices and labels
-        labels = tf.gather_nd(labels, indices)
-        scores = tf.gather_nd(
-            class_predictions,
-            indices=tf.keras.backend.stack([indices[:, 0], labels], axis=1),
-        )
-
-        scores, top_indices = tf.nn.top_k(
-            scores,
-            k=tf.keras.backend.minimum(
-                self.max_total_detections, tf.keras.backend.shape(scores)[0]
-            ),
+        # Filter scores below the confidence threshold and perform per class non-max suppression
+        # in a single fused op, which returns the top detections sorted by score.
+        # Boxes are shared across classes, so they have a class axis of size 1.
+        boxes, scores, labels, num_detections = tf.image.combined_non_max_suppression(
+            boxes=box_prediction[tf.newaxis, :, tf.newaxis, :],
+            scores=class_predictions[tf.newaxis],
+            max_output_size_per_class=self.max_detections_per_class,
+            max_total_size=self.max_total_detections,
+            iou_threshold=self.iou_threshold,
+            score_threshold=self.confidence_threshold,
+            clip_boxes=False,
         )
 
-        # Filter input using the final set of indices
-        indices = tf.gather(indices, top_indices)
-        boxes = tf.gather(box_prediction, indices)
-        labels = tf.gather(labels, top_indices)
+        # Drop the padding after the valid detections
+        num_detections = num_detections[0]
+        boxes = tf.expand_dims(boxes[0, :num_detections], axis=1)
+        scores = scores[0, :num_detections]
+        labels = labels[0, :num_detections]
 
         # Outputs should either be named or be in order of location, category, score to comply with RDK
         bounding_boxes = {
             "boxes": boxes,
             # Since the prediction decoder is expected batched input,
             # we expand the dims such that the batch size is 1.
-            "classes": tf.expand_dims(tf.cast(labels, dtype=tf.float32), axis=1),
+            "classes": tf.expand_dims(labels, axis=1),
             "confidence": tf.expand_dims(scores, axis=1),
             "num_detections": tf.cast(
                 [tf.keras.backend.shape(boxes)[1]], dtype=tf.float32
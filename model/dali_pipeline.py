@@ -0,0 +1,182 @@
+import os
+import typing as ty
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import nvidia.dali.fn as fn
+    import nvidia.dali.math as dmath
+    import nvidia.dali.plugin.tf as dali_tf
+    import nvidia.dali.types as types
+    from nvidia.dali import Pipeline
+except ImportError:
+    dali_tf = None
+
+# nvJPEG batched decoding only outperforms decoding on the CPU for batches at least this large
+DALI_MIN_BATCH_SIZE = 64
+
+
+def dali_available() -> bool:
+    """Returns whether NVIDIA DALI is installed, which is required to decode images on the GPU."""
+    return dali_tf is not None
+
+
+def pad_annotations(
+    label_values: np.ndarray,
+    coord_values: np.ndarray,
+    bbox_row_lengths: np.ndarray,
+    indices: np.ndarray,
+    max_boxes: int = 32,
+) -> ty.Tuple[np.ndarray, np.ndarray]:
+    """Returns the dense bboxes and labels of the images at indices, padded with -1 up to max_boxes,
+    in the same format as bounding_box.to_dense.
+    Args:
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the rel_yxyx coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image
+        indices: indices of the images in this split
+        max_boxes: maximum number of bounding boxes per image
+    """
+    row_splits = np.concatenate([[0], np.cumsum(bbox_row_lengths)])
+    boxes = np.full((len(indices), max_boxes, 4), -1, dtype=np.float32)
+    classes = np.full((len(indices), max_boxes), -1, dtype=np.int32)
+    for row, i in enumerate(indices):
+        start = row_splits[i]
+        end = min(row_splits[i + 1], start + max_boxes)
+        boxes[row, : end - start] = coord_values[start:end]
+        classes[row, : end - start] = label_values[start:end]
+    return boxes, classes
+
+
+def build_dali_pipeline(
+    filenames: np.ndarray,
+    target_shape: ty.Tuple[int, int, int],
+    batch_size: int,
+    device_id: int = 0,
+    seed: int = 0,
+) -> "Pipeline":
+    """Returns a DALI pipeline that reads the images, reshuffled every epoch, decodes them on the GPU with nvJPEG
+    and resizes them with padding, matching tf.image.resize_with_pad. Along with each image, it returns the position
+    of its file in filenames, and the scale and offset that map its rel_yxyx bboxes onto the padded image.
+    Args:
+        filenames: string array of image paths
+        target_shape: 3D shape of the images
+        batch_size: number of images in each batch
+        device_id: index of the GPU
+        seed: seed of the shuffle of every epoch
+    """
+    height, width = float(target_shape[0]), float(target_shape[1])
+    pipeline = Pipeline(
+        batch_size=batch_size,
+        num_threads=os.cpu_count(),
+        device_id=device_id,
+        seed=seed,
+    )
+    with pipeline:
+        # Label each file with its position, which the annotations are looked up by, see create_dali_dataset
+        encoded, index = fn.readers.file(
+            files=[str(filename) for filename in filenames],
+            labels=list(range(len(filenames))),
+            shuffle_after_epoch=True,
+            name="Reader",
+        )
+        # Compute the resized size and padding the same way as tf.image.resize_with_pad
+        image_shape = fn.cast(fn.peek_image_shape(encoded), dtype=types.FLOAT)
+        ratio = dmath.max(image_shape[1] / width, image_shape[0] / height)
+        resized_height = dmath.floor(image_shape[0] / ratio)
+        resized_width = dmath.floor(image_shape[1] / ratio)
+        pad_top = dmath.floor((height - image_shape[0] / ratio) / 2)
+        pad_left = dmath.floor((width - image_shape[1] / ratio) / 2)
+
+        images = fn.decoders.image(encoded, device="mixed", output_type=types.RGB)
+        images = fn.resize(
+            images, resize_y=resized_height, resize_x=resized_width, antialias=False
+        )
+        images = fn.slice(
+            images,
+            anchor=fn.stack(-pad_top, -pad_left),
+            shape=[target_shape[0], target_shape[1]],
+            axis_names="HW",
+            normalized_anchor=False,
+            normalized_shape=False,
+            out_of_bounds_policy="pad",
+            fill_values=0,
+        )
+        images = fn.cast(images, dtype=types.FLOAT)
+
+        scale = fn.stack(
+            resized_height / height,
+            resized_width / width,
+            resized_height / height,
+            resized_width / width,
+        )
+        offset = fn.stack(
+            pad_top / height, pad_left / width, pad_top / height, pad_left / width
+        )
+        pipeline.set_outputs(images, index.gpu(), scale.gpu(), offset.gpu())
+    return pipeline
+
+
+def create_dali_dataset(
+    filenames: np.ndarray,
+    label_values: np.ndarray,
+    coord_values: np.ndarray,
+    bbox_row_lengths: np.ndarray,
+    indices: np.ndarray,
+    target_shape: ty.Tuple[int, int, int] = (256, 256, 3),
+    max_boxes: int = 32,
+    batch_size: int = 64,
+    device_id: int = 0,
+    seed: int = 0,
+) -> tf.data.Dataset:
+    """Returns an endless dataset of (images, bounding_boxes) batches decoded on the GPU, in the same format as create_dataset_detection.
+    Since the dataset doesn't end, training must set steps_per_epoch.
+    Args:
+        filenames: string array of image paths
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the rel_yxyx coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image
+        indices: indices of the images in this split
+        target_shape: 3D shape of the images
+        max_boxes: maximum number of bounding boxes per image
+        batch_size: number of images in each batch
+        device_id: index of the GPU
+        seed: seed of the shuffle of every epoch
+    """
+    if not dali_available():
+        raise ImportError("Decoding images on the GPU requires nvidia-dali")
+    boxes, classes = pad_annotations(
+        label_values, coord_values, bbox_row_lengths, indices, max_boxes=max_boxes
+    )
+    pipeline = build_dali_pipeline(
+        filenames[indices], target_shape, batch_size, device_id=device_id, seed=seed
+    )
+    with tf.device(f"/gpu:{device_id}"):
+        dataset = dali_tf.DALIDataset(
+            pipeline=pipeline,
+            batch_size=batch_size,
+            output_shapes=(
+                (batch_size,) + tuple(target_shape),
+                (batch_size, 1),
+                (batch_size, 4),
+                (batch_size, 4),
+            ),
+            output_dtypes=(tf.float32, tf.int32, tf.float32, tf.float32),
+            device_id=device_id,
+        )
+        boxes = tf.constant(boxes)
+        classes = tf.constant(classes)
+
+        def lookup_annotations(images, index, scale, offset):
+            # Map the valid bboxes onto the padded image, keeping the padding bboxes at -1
+            batch_classes = tf.gather(classes, index[:, 0])
+            batch_boxes = tf.where(
+                batch_classes[..., tf.newaxis] >= 0,
+                tf.gather(boxes, index[:, 0]) * scale[:, tf.newaxis]
+                + offset[:, tf.newaxis],
+                -1.0,
+            )
+            return images, {"boxes": batch_boxes, "classes": batch_classes}
+
+        return dataset.map(lookup_annotations)
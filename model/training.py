@@ -1,14 +1,19 @@
 import argparse
-import json
 import os
+import shutil
 import typing as ty
+import warnings
 
+import numpy as np
+import orjson
 import tensorflow as tf
 from tensorflow import keras
 import keras_cv
 from keras_cv import bounding_box
 from keras import Model
+from .augmented_retinanet import AugmentedRetinaNet
 from .combined_nms import CombinedNMS
+from .dali_pipeline import DALI_MIN_BATCH_SIZE, create_dali_dataset, dali_available
 
 TFLITE_OPS = [
     tf.lite.OpsSet.TFLITE_BUILTINS,  # enable TensorFlow Lite ops.
@@ -17,97 +22,403 @@ TFLITE_OPS = [
 
 TFLITE_OPTIMIZATIONS = [tf.lite.Optimize.DEFAULT]
 
+# Number of images used to calibrate the int8 quantization of activations
+REPRESENTATIVE_DATASET_SIZE = 200
+
 labels_filename = "labels.txt"
 
+# Decoded datasets larger than this are cached to disk rather than held in memory
+IN_MEMORY_CACHE_LIMIT_BYTES = 4 * 1024**3
+
+# Names of the dataset splits, in the order returned by split_indices
+SPLITS = ("train", "val", "test")
+
+# Features of the preprocessed examples written by model.write_tfrecords
+TFRECORD_FEATURES = {
+    "image": tf.io.FixedLenFeature([], tf.string),
+    "boxes": tf.io.VarLenFeature(tf.float32),
+    "classes": tf.io.VarLenFeature(tf.int64),
+}
+
 
 def parse_args():
-    """Returns dataset file, model output directory, and num_epochs if present. These must be parsed as command line
+    """Returns dataset file, model output directory, num_epochs, TFRecord shard prefix, snapshot directory, and whether to decode on the GPU. These must be parsed as command line
     arguments and then used as the model input and output, respectively. The number of epochs can be used to optionally override the default.
+    The TFRecord shard prefix optionally points at shards written by model.write_tfrecords for the same dataset file.
+    The snapshot directory optionally persists the decoded dataset across training runs.
+    Decoding the training images on the GPU optionally uses NVIDIA DALI, installed with the "dali" extra.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset_file", dest="data_json", type=str)
     parser.add_argument("--model_output_directory", dest="model_dir", type=str)
     parser.add_argument("--num_epochs", dest="num_epochs", type=int)
+    parser.add_argument(
+        "--tfrecord_prefix", dest="tfrecord_prefix", type=str, default=""
+    )
+    parser.add_argument(
+        "--snapshot_directory", dest="snapshot_dir", type=str, default=""
+    )
+    parser.add_argument("--use_dali", dest="use_dali", action="store_true")
     args = parser.parse_args()
-    return args.data_json, args.model_dir, args.num_epochs
+    return (
+        args.data_json,
+        args.model_dir,
+        args.num_epochs,
+        args.tfrecord_prefix,
+        args.snapshot_dir,
+        args.use_dali,
+    )
 
 
 def parse_filenames_and_bboxes_from_json(
     filename: str,
     all_labels: ty.List[str],
-) -> ty.Tuple[ty.List[str], ty.List[str], ty.List[ty.List[float]]]:
+) -> ty.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Load and parse JSON file to return image filenames and corresponding labels with bboxes.
         The JSON file contains lines, where each line has the key "image_path" and "bounding_box_annotations".
+        The labels and bboxes of all images are returned as flat arrays, where consecutive runs of
+        bbox_row_lengths[i] rows belong to image i, see pack_annotations.
     Args:
         filename: JSONLines file containing filenames and bboxes
         all_labels: list of all N_LABELS
+    Returns:
+        image_filenames: string array of image paths
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image
     """
     image_filenames = []
-    bbox_labels = []
-    bbox_coords = []
+    label_values = []
+    coord_values = []
+    bbox_row_lengths = []
+    # Encode labels as their index in all_labels while parsing, skipping labels that aren't in all_labels
+    label_to_id = {label: i for i, label in enumerate(all_labels)}
 
     with open(filename, "rb") as f:
-        for line in f:
-            json_line = json.loads(line)
-            image_filenames.append(json_line["image_path"])
-            annotations = json_line["bounding_box_annotations"]
-            labels = []
-            coords = []
-            for annotation in annotations:
-                if annotation["annotation_label"] in all_labels:
-                    labels.append(annotation["annotation_label"])
-                    # Store coordinates in rel_yxyx format so that we can use the keras_cv function
-                    coords.append(
-                        [
-                            annotation["y_min_normalized"],
-                            annotation["x_min_normalized"],
-                            annotation["y_max_normalized"],
-                            annotation["x_max_normalized"],
-                        ]
-                    )
-            bbox_labels.append(labels)
-            bbox_coords.append(coords)
-    return image_filenames, bbox_labels, bbox_coords
+        lines = f.read().splitlines()
+    for line in lines:
+        if not line.strip():
+            continue
+        json_line = orjson.loads(line)
+        image_filenames.append(json_line["image_path"])
+        num_bboxes = 0
+        for annotation in json_line["bounding_box_annotations"]:
+            label_id = label_to_id.get(annotation["annotation_label"])
+            if label_id is None:
+                continue
+            label_values.append(label_id)
+            # Store coordinates in rel_yxyx format so that we can use the keras_cv function
+            coord_values.extend(
+                (
+                    annotation["y_min_normalized"],
+                    annotation["x_min_normalized"],
+                    annotation["y_max_normalized"],
+                    annotation["x_max_normalized"],
+                )
+            )
+            num_bboxes += 1
+        bbox_row_lengths.append(num_bboxes)
+    return (
+        np.array(image_filenames, dtype=str),
+        np.array(label_values, dtype=np.int32),
+        np.array(coord_values, dtype=np.float32).reshape(-1, 4),
+        np.array(bbox_row_lengths, dtype=np.int32),
+    )
+
+
+def decode_jpeg_at_scale(
+    image_string: tf.Tensor, img_size: ty.Tuple[int, int]
+) -> tf.Tensor:
+    """Decodes a JPEG downscaled by the largest power of two (up to 8) that keeps it at least img_size.
+    Downscaling inside the decoder skips most of the IDCT work for images much larger than img_size.
+    Args:
+        image_string: scalar string tensor containing the encoded JPEG
+        img_size: intended height and width of the image after resizing
+    """
+    jpeg_shape = tf.io.extract_jpeg_shape(image_string)
+    scale = tf.minimum(jpeg_shape[0] // img_size[0], jpeg_shape[1] // img_size[1])
+    # decode_jpeg only accepts a constant ratio, so select between the supported ratios 1, 2, 4, and 8
+    ratio_index = (
+        tf.cast(scale >= 2, tf.int32)
+        + tf.cast(scale >= 4, tf.int32)
+        + tf.cast(scale >= 8, tf.int32)
+    )
+    return tf.switch_case(
+        ratio_index,
+        [
+            lambda ratio=ratio: tf.image.decode_jpeg(
+                image_string,
+                channels=3,
+                ratio=ratio,
+                dct_method="INTEGER_FAST",
+                fancy_upsampling=False,
+            )
+            for ratio in (1, 2, 4, 8)
+        ],
+    )
+
+
+def decode_image(
+    image_string: tf.Tensor, img_size: ty.Tuple[int, int] = (256, 256)
+) -> tf.Tensor:
+    """Decodes an encoded image into a uint8 tensor with 3 channels. JPEGs use the faster
+    integer IDCT and are downscaled while decoding, while other formats (e.g. PNG) fall back to the generic decoder.
+    Args:
+        image_string: scalar string tensor containing the encoded image
+        img_size: intended height and width of the image after resizing
+    """
+    return tf.cond(
+        tf.io.is_jpeg(image_string),
+        lambda: decode_jpeg_at_scale(image_string, img_size),
+        lambda: tf.image.decode_image(
+            image_string,
+            channels=3,
+            expand_animations=False,
+            dtype=tf.dtypes.uint8,
+        ),
+    )
+
+
+def letterbox_scale_and_offset(
+    image_size: tf.Tensor, img_size: ty.Tuple[int, int]
+) -> ty.Tuple[tf.Tensor, tf.Tensor]:
+    """Returns the scale and offset that map rel_yxyx coordinates of an image onto the image after tf.image.resize_with_pad.
+    The resized size and padding are computed the same way as in tf.image.resize_with_pad.
+    Args:
+        image_size: height and width of the original image
+        img_size: height and width the image is resized and padded to
+    """
+    height = tf.cast(image_size[0], tf.float32)
+    width = tf.cast(image_size[1], tf.float32)
+    target_height = float(img_size[0])
+    target_width = float(img_size[1])
+    ratio = tf.maximum(width / target_width, height / target_height)
+    resized_height = height / ratio
+    resized_width = width / ratio
+    pad_top = tf.floor((target_height - resized_height) / 2)
+    pad_left = tf.floor((target_width - resized_width) / 2)
+    scale = tf.stack(
+        [
+            tf.floor(resized_height) / target_height,
+            tf.floor(resized_width) / target_width,
+        ]
+        * 2
+    )
+    offset = tf.stack([pad_top / target_height, pad_left / target_width] * 2)
+    return scale, offset
+
+
+def pad_rel_yxyx_bboxes(
+    boxes: tf.Tensor, image_size: tf.Tensor, img_size: ty.Tuple[int, int]
+) -> tf.Tensor:
+    """Maps rel_yxyx bounding boxes of an image onto the image after tf.image.resize_with_pad.
+    Args:
+        boxes: tensor of shape [num_bboxes, 4] with rel_yxyx coordinates relative to the original image
+        image_size: height and width of the original image
+        img_size: height and width the image is resized and padded to
+    """
+    scale, offset = letterbox_scale_and_offset(image_size, img_size)
+    return boxes * scale + offset
+
+
+def unpad_rel_yxyx_bboxes(
+    boxes: tf.Tensor, image_size: tf.Tensor, img_size: ty.Tuple[int, int]
+) -> tf.Tensor:
+    """Maps rel_yxyx bounding boxes of an image after tf.image.resize_with_pad back onto the original image,
+    clipping the parts that lie in the padding. This is the inverse of pad_rel_yxyx_bboxes.
+    Args:
+        boxes: tensor of shape [..., 4] with rel_yxyx coordinates relative to the resized and padded image
+        image_size: height and width of the original image
+        img_size: height and width the image was resized and padded to
+    """
+    scale, offset = letterbox_scale_and_offset(image_size, img_size)
+    return tf.clip_by_value((boxes - offset) / scale, 0.0, 1.0)
 
 
 def parse_image_and_encode_bboxes(
     data: tf.data.Dataset,
-    all_labels: ty.List[str],
-    src_bbox_format: str,
-    tgt_bbox_format: str,
     img_size: ty.Tuple[int, int] = (256, 256),
 ) -> dict:
-    """Returns a dictionary of normalized image array, integer encoded labels array, and bounding box coordinates.
+    """Returns a dictionary of uint8 image array, integer encoded labels array, and bounding box coordinates.
+    Images stay uint8 so that they take a quarter of the memory when cached, see cast_images.
+    Labels are already encoded by parse_filenames_and_bboxes_from_json and are passed through unchanged.
+    Bounding boxes are expected in rel_yxyx, are adjusted for the padding of the image, and are otherwise
+    left in their source format, see convert_batched_bboxes.
     Args:
         data: dataset in dictionary format containing images and their bounding boxes
-        all_labels: list of all N_LABELS
-        src_bbox_format: input format of the bboxes
-        tgt_bbox_format: format of the bboxes for use in model training
     """
     image_string = tf.io.read_file(data["images"])
-    image_decoded = tf.image.decode_image(
-        image_string,
-        channels=3,
-        expand_animations=False,
-        dtype=tf.dtypes.uint8,
+    image_decoded = decode_image(image_string, img_size)
+    # Resize it to fixed shape, padding it to preserve its aspect ratio
+    image_resized = tf.image.resize_with_pad(
+        image_decoded,
+        img_size[0],
+        img_size[1],
+        method=tf.image.ResizeMethod.BILINEAR,
+        antialias=False,
     )
-    # Resize it to fixed shape
-    image_resized = tf.image.resize(image_decoded, [img_size[0], img_size[1]])
-    # Convert string labels to encoded labels
-    encoder = tf.keras.layers.StringLookup(
-        vocabulary=all_labels, num_oov_indices=0, output_mode="int"
+    boxes = pad_rel_yxyx_bboxes(
+        data["bounding_boxes"]["boxes"], tf.shape(image_decoded)[0:2], img_size
     )
-    labels_encoded = encoder(data["bounding_boxes"]["classes"])
-    # Convert bboxes to their intended format
-    boxes = convert_bboxes(
-        data["bounding_boxes"]["boxes"], src_bbox_format, tgt_bbox_format, image_resized
-    )
-    data["images"] = image_resized
-    data["bounding_boxes"]["classes"] = labels_encoded
+    data["images"] = tf.saturate_cast(tf.round(image_resized), tf.uint8)
     data["bounding_boxes"]["boxes"] = boxes
     return data
 
 
+def cast_images(data: dict) -> dict:
+    """Casts the uint8 images of a parsed observation to float32 for the model, once they have been cached.
+    Args:
+        data: dictionary returned by parse_image_and_encode_bboxes
+    """
+    data["images"] = tf.cast(data["images"], tf.float32)
+    return data
+
+
+def parse_tfrecord_example(
+    serialized: tf.Tensor, img_size: ty.Tuple[int, int] = (256, 256)
+) -> dict:
+    """Returns the same dictionary as parse_image_and_encode_bboxes from an example written by model.write_tfrecords.
+    Args:
+        serialized: scalar string tensor containing a serialized tf.train.Example
+        img_size: height and width of the images stored in the example
+    """
+    features = tf.io.parse_single_example(serialized, TFRECORD_FEATURES)
+    image = tf.reshape(
+        tf.io.decode_raw(features["image"], tf.uint8), [img_size[0], img_size[1], 3]
+    )
+    return {
+        "images": image,
+        "bounding_boxes": {
+            "boxes": tf.reshape(tf.sparse.to_dense(features["boxes"]), [-1, 4]),
+            "classes": tf.cast(tf.sparse.to_dense(features["classes"]), tf.int32),
+        },
+    }
+
+
+def tfrecord_metadata(
+    num_images: int,
+    all_labels: ty.List[str],
+    img_size: ty.Tuple[int, int],
+    train_split: float,
+    split_seed: int,
+) -> dict:
+    """Returns the parameters that TFRecord shards were written with, which training must read them with.
+    Args:
+        num_images: number of images in the dataset file the shards were written from
+        all_labels: list of all labels, whose order defines the encoded classes
+        img_size: height and width of the images stored in the shards
+        train_split: float between 0.0 and 1.0 to specify proportion of images that were written for training
+        split_seed: seed of the shuffle that assigned images to the splits
+    """
+    return {
+        "num_images": int(num_images),
+        "labels": list(all_labels),
+        "image_size": [int(img_size[0]), int(img_size[1])],
+        "train_split": float(train_split),
+        "split_seed": int(split_seed),
+    }
+
+
+def tfrecord_metadata_path(tfrecord_prefix: str) -> str:
+    """Returns the path of the metadata file written next to the TFRecord shards."""
+    return f"{tfrecord_prefix}-meta.json"
+
+
+def check_tfrecord_metadata(
+    tfrecord_prefix: str,
+    num_images: int,
+    all_labels: ty.List[str],
+    img_size: ty.Tuple[int, int],
+    train_split: float,
+    split_seed: int,
+) -> None:
+    """Raises a ValueError if the TFRecord shards were written from a dataset file with another number of images,
+    or with other labels, image size, or split than used for training.
+    Args:
+        tfrecord_prefix: prefix of the TFRecord shards written by model.write_tfrecords
+        num_images: number of images in the dataset file used for training
+        all_labels: list of all labels, whose order defines the encoded classes
+        img_size: height and width of the images used for training
+        train_split: float between 0.0 and 1.0 to specify proportion of images that will be used for training
+        split_seed: seed of the shuffle that assigns images to the splits
+    """
+    with open(tfrecord_metadata_path(tfrecord_prefix), "rb") as f:
+        written = orjson.loads(f.read())
+    expected = tfrecord_metadata(
+        num_images, all_labels, img_size, train_split, split_seed
+    )
+    mismatched = [key for key in expected if written.get(key) != expected[key]]
+    if mismatched:
+        raise ValueError(
+            f"TFRecord shards at {tfrecord_prefix} were written with "
+            + ", ".join(f"{key}={written.get(key)}" for key in mismatched)
+            + ", but training uses "
+            + ", ".join(f"{key}={expected[key]}" for key in mismatched)
+        )
+
+
+def split_indices(
+    num_samples: int, train_split: float = 0.8, seed: int = 0
+) -> ty.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns shuffled indices of the training, validation, and testing samples.
+    The samples not used for training are split evenly between validation and testing.
+    Args:
+        num_samples: total number of samples
+        train_split: float between 0.0 and 1.0 to specify proportion of samples that will be used for training
+        seed: seed of the shuffle, so that the same split can be reproduced
+    """
+    indices = np.random.default_rng(seed).permutation(num_samples)
+    train_size = int(train_split * num_samples)
+    val_size = int((1 - train_split) * 0.5 * num_samples)
+    return (
+        indices[:train_size],
+        indices[train_size : train_size + val_size],
+        indices[train_size + val_size :],
+    )
+
+
+def pack_annotations(
+    label_values: np.ndarray,
+    coord_values: np.ndarray,
+    bbox_row_lengths: np.ndarray,
+) -> ty.Tuple[tf.RaggedTensor, tf.RaggedTensor]:
+    """Returns ragged tensors of the labels and bboxes of each image, built directly from their flat arrays.
+    Args:
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image
+    """
+    # Boxes and classes are ragged as the inputs may be non-rectangular
+    # This happens when we have a different number of bboxes per image
+    classes = tf.RaggedTensor.from_row_lengths(label_values, bbox_row_lengths)
+    boxes = tf.RaggedTensor.from_row_lengths(
+        coord_values.reshape(-1, 4), bbox_row_lengths
+    )
+    return classes, boxes
+
+
+def slice_annotations(
+    filenames: np.ndarray,
+    classes: tf.RaggedTensor,
+    boxes: tf.RaggedTensor,
+) -> tf.data.Dataset:
+    """Returns a dataset of image paths with their unparsed labels and bounding boxes.
+    Args:
+        filenames: string array of image paths
+        classes: ragged tensor of shape [num_images, None] with the labels associated with bboxes
+        boxes: ragged tensor of shape [num_images, None, 4] with the coordinates identifying bboxes
+    """
+    return tf.data.Dataset.from_tensor_slices(
+        {
+            "images": filenames,
+            "bounding_boxes": {
+                "boxes": boxes,
+                "classes": classes,
+            },
+        }
+    )
+
+
 def convert_bboxes(
     bboxes: tf.Tensor,
     src_bbox_format: str,
@@ -132,6 +443,24 @@ def convert_bboxes(
     )
 
 
+def convert_batched_bboxes(
+    inputs: dict, src_bbox_format: str, tgt_bbox_format: str
+) -> dict:
+    """Converts the bounding boxes of a whole batch from one format to another
+    Args:
+        inputs: nested dictionary of batched data with keys "images" and "bounding_boxes"
+        src_bbox_format: input format of the bboxes
+        tgt_bbox_format: format of the bboxes for use in model training
+    """
+    inputs["bounding_boxes"]["boxes"] = convert_bboxes(
+        inputs["bounding_boxes"]["boxes"],
+        src_bbox_format,
+        tgt_bbox_format,
+        inputs["images"],
+    )
+    return inputs
+
+
 def convert_to_tuple(inputs: dict, max_boxes: int) -> ty.Tuple[tf.Tensor, tf.Tensor]:
     """Converts dictionary of inputs into tuple of images and their corresponding bounding boxes
     Args:
@@ -143,10 +472,31 @@ def convert_to_tuple(inputs: dict, max_boxes: int) -> ty.Tuple[tf.Tensor, tf.Ten
     )
 
 
+def dataset_options() -> tf.data.Options:
+    """Returns tf.data options that enable static optimizations fusing and parallelizing the pipeline's map and batch stages."""
+    options = tf.data.Options()
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    options.experimental_optimization.noop_elimination = True
+    options.experimental_optimization.parallel_batch = True
+    # Elements may be produced out of order, since the splits are separate datasets
+    options.deterministic = False
+    # Size the pool to the cores this process may run on, which can be fewer than os.cpu_count() in a container.
+    # Each element is processed by a single thread, so ops within a map don't compete with parallel calls for cores.
+    options.threading.private_threadpool_size = (
+        len(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else os.cpu_count()
+    )
+    options.threading.max_intra_op_parallelism = 1
+    return options
+
+
 def create_dataset_detection(
-    filenames: ty.List[str],
-    classes: ty.List[str],
-    boxes: ty.List[int],
+    filenames: np.ndarray,
+    label_values: np.ndarray,
+    coord_values: np.ndarray,
+    bbox_row_lengths: np.ndarray,
     all_labels: ty.List[str],
     src_bbox_format: str,
     tgt_bbox_format: str,
@@ -157,13 +507,19 @@ def create_dataset_detection(
     shuffle_buffer_size: int = 1024,
     num_parallel_calls: int = tf.data.experimental.AUTOTUNE,
     prefetch_buffer_size: int = tf.data.experimental.AUTOTUNE,
+    cache_path: str = "",
+    tfrecord_prefix: str = "",
+    split_seed: int = 0,
+    snapshot_path: str = "",
+    use_dali: bool = False,
 ) -> ty.Tuple[tf.data.Dataset, tf.data.Dataset, tf.data.Dataset]:
     """Load and parse dataset into Tensorflow datasets.
     Args:
-        filenames: string list of image paths
-        classes: list of string lists, where each string list contains up to max_boxes labels associated with bboxes
-        boxes: list of nested int lists, where each int list contains up to max_boxes of the four coordinates identifying bboxes
-        all_labels: string list of all N_LABELS
+        filenames: string array of image paths
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image, each up to max_boxes
+        all_labels: list of all labels the classes are encoded against, which TFRecord shards must have been written with
         src_bbox_format: input format of the bboxes
         tgt_bbox_format: format of the bboxes for use in model training
         target_shape: optional 3D shape of image
@@ -173,116 +529,204 @@ def create_dataset_detection(
         shuffle_buffer_size: optional size for buffer that will be filled and randomly sampled from, with replacement
         num_parallel_calls: optional integer representing the number of batches to compute asynchronously in parallel
         prefetch_buffer_size: optional integer representing the number of batches that will be buffered when prefetching
+        cache_path: optional file path prefix to cache decoded images on disk; if empty, they are cached in memory
+        tfrecord_prefix: optional prefix of TFRecord shards written by model.write_tfrecords; if set, images are read from the shards
+        split_seed: optional seed of the shuffle that assigns images to the training, validation, and testing splits
+        snapshot_path: optional directory to snapshot decoded images to, so that later training runs can reuse them; if set, it replaces the cache
+        use_dali: optional flag to decode training images on the GPU with NVIDIA DALI; the training dataset then never ends, so training must set steps_per_epoch
 
     """
-    # Create a first dataset of file paths and labels
-    dataset = tf.data.Dataset.from_tensor_slices(
-        {
-            "images": filenames,
-            "bounding_boxes": {
-                # Turn boxes and classes into ragged tensors as the inputs may be non-rectangular
-                # This happens when we have a different number of bboxes per image
-                "boxes": tf.ragged.constant(boxes, ragged_rank=1),
-                "classes": tf.ragged.constant(classes),
-            },
-        }
-    )
-
-    # Apply a map to the dataset that converts filenames, text labels, and bounding boxes
-    # to normalized images, encoded labels, and bounding boxes coordinates, respectively.
-    def mapping_fnc(x):
-        return parse_image_and_encode_bboxes(
-            x, all_labels, src_bbox_format, tgt_bbox_format, target_shape[0:2]
+    if src_bbox_format != "rel_yxyx":
+        # Images are padded to their aspect ratio while parsing, which adjusts the bboxes as rel_yxyx
+        raise ValueError(
+            f"Bounding boxes must be parsed as rel_yxyx, got {src_bbox_format}"
+        )
+    if use_dali and src_bbox_format != tgt_bbox_format:
+        raise ValueError(
+            f"Decoding on the GPU keeps bounding boxes as {src_bbox_format}, got {tgt_bbox_format}"
+        )
+    if tfrecord_prefix and use_dali:
+        raise ValueError(
+            "Decoding on the GPU reads the original images, so it can't be combined with TFRecord shards"
+        )
+    if tfrecord_prefix:
+        check_tfrecord_metadata(
+            tfrecord_prefix,
+            len(filenames),
+            all_labels,
+            target_shape[:2],
+            train_split,
+            split_seed,
         )
 
-    # Parse and preprocess observations in parallel
-    dataset = dataset.map(mapping_fnc, num_parallel_calls=num_parallel_calls)
-
-    # Shuffle the data for each buffer size
-    # Disabling reshuffling ensures items from the training and test set will not get shuffled into each other
-    dataset = dataset.shuffle(
-        buffer_size=shuffle_buffer_size, reshuffle_each_iteration=False
+    # Split the images before building any datasets, so that each split only reads and decodes its own images
+    train_indices, val_indices, test_indices = split_indices(
+        len(filenames), train_split, split_seed
     )
 
-    train_size = int(train_split * len(filenames))
-    val_size = int((1 - train_split) * 0.5 * len(filenames))
-    test_size = len(filenames) - train_size - val_size
-    train_dataset = dataset.take(train_size)
-    val_dataset = dataset.skip(train_size).take(val_size)
-    test_dataset = dataset.skip(val_size + train_size)
-
-    # Batch the data for multiple steps
-    # If the size of training, validation, or testing data is smaller than the batch size,
-    # batch the data to expand the dimensions by a length 1 axis.
-    # This will ensure that the training data is valid model input
-    train_batch_size = batch_size if batch_size < train_size else train_size
-    train_dataset = train_dataset.apply(
-        tf.data.experimental.dense_to_ragged_batch(train_batch_size)
-    )
-    val_batch_size = batch_size if batch_size < val_size else val_size
-    val_dataset = val_dataset.apply(
-        tf.data.experimental.dense_to_ragged_batch(val_batch_size)
-    )
-    test_batch_size = batch_size if batch_size < test_size else test_size
-    test_dataset = test_dataset.apply(
-        tf.data.experimental.dense_to_ragged_batch(test_batch_size)
-    )
-    inference_resizing = keras_cv.layers.Resizing(
-        target_shape[0],
-        target_shape[1],
-        bounding_box_format=tgt_bbox_format,
-        pad_to_aspect_ratio=True,
-    )
-    val_dataset = val_dataset.map(
-        inference_resizing, num_parallel_calls=tf.data.AUTOTUNE
-    )
-    test_dataset = test_dataset.map(
-        inference_resizing, num_parallel_calls=tf.data.AUTOTUNE
-    )
+    if not tfrecord_prefix:
+        classes, boxes = pack_annotations(label_values, coord_values, bbox_row_lengths)
+
+        # Apply a map to the dataset that converts filenames and bounding boxes
+        # to normalized images and bounding boxes coordinates, respectively.
+        # The explicit signature traces it a single time for every split, with the image size as a constant.
+        @tf.function(
+            input_signature=[
+                {
+                    "images": tf.TensorSpec([], tf.string),
+                    "bounding_boxes": {
+                        "boxes": tf.TensorSpec([None, 4], tf.float32),
+                        "classes": tf.TensorSpec([None], tf.int32),
+                    },
+                }
+            ]
+        )
+        def mapping_fnc(x):
+            return parse_image_and_encode_bboxes(x, target_shape[0:2])
+
+    def load_split(split: str, indices: np.ndarray) -> tf.data.Dataset:
+        if tfrecord_prefix:
+            # Read the already decoded and resized images from the split's shards in parallel
+            dataset = tf.data.Dataset.list_files(
+                f"{tfrecord_prefix}-{split}-*.tfrecord", shuffle=False
+            ).interleave(
+                tf.data.TFRecordDataset,
+                cycle_length=16,
+                num_parallel_calls=num_parallel_calls,
+                deterministic=False,
+            )
+            dataset = dataset.map(
+                lambda x: parse_tfrecord_example(x, target_shape[0:2]),
+                num_parallel_calls=num_parallel_calls,
+            )
+        else:
+            # Create a first dataset of file paths and labels
+            dataset = slice_annotations(
+                filenames[indices],
+                tf.gather(classes, indices),
+                tf.gather(boxes, indices),
+            )
+            # Parse and preprocess observations in parallel
+            dataset = dataset.map(mapping_fnc, num_parallel_calls=num_parallel_calls)
+
+        dataset = dataset.with_options(dataset_options())
+
+        if snapshot_path:
+            # Persist the decoded and resized images on disk, so that they are reused across epochs and training runs.
+            # The snapshot files are read back in parallel.
+            dataset = dataset.snapshot(
+                os.path.join(snapshot_path, split),
+                compression="SNAPPY",
+                reader_func=lambda datasets: datasets.interleave(
+                    lambda x: x,
+                    cycle_length=16,
+                    num_parallel_calls=num_parallel_calls,
+                    deterministic=False,
+                ),
+            )
+        else:
+            # Cache the decoded and resized images so that reading, decoding, and resizing only happens in the first epoch.
+            # Augmentations are applied after the cache so that they are still sampled anew every epoch.
+            dataset = dataset.cache(
+                filename=f"{cache_path}_{split}" if cache_path else ""
+            )
+
+        # Images are snapshotted or cached as uint8, taking 1 byte per channel, and only cast to float32 afterwards
+        return dataset.map(cast_images, num_parallel_calls=num_parallel_calls)
+
+    # DALI decodes the training images on the GPU instead, so their tf.data pipeline isn't built at all
+    datasets = {}
+    for split, indices in zip(SPLITS, (train_indices, val_indices, test_indices)):
+        if split == "train" and use_dali:
+            continue
+        dataset = load_split(split, indices)
+        if split == "train":
+            # Shuffle the training data for each buffer size, in a new order every epoch
+            dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
+        # Batch the data for multiple steps
+        # If the size of training, validation, or testing data is smaller than the batch size,
+        # batch the data to expand the dimensions by a length 1 axis.
+        # This will ensure that the training data is valid model input
+        datasets[split] = dataset.apply(
+            tf.data.experimental.dense_to_ragged_batch(min(batch_size, len(indices)))
+        )
 
-    # Apply augmentations for that preserve bbox characteristics relative to image
-    random_flip = keras_cv.layers.RandomFlip(
-        mode="horizontal", bounding_box_format=tgt_bbox_format
-    )
-    # This operation randomly rescales image with a RV from distribution defined by scale_factor,
-    # crops to crop_size, and then pads cropped image to target_shape
-    jittered_resize = keras_cv.layers.JitteredResize(
-        target_size=target_shape[0:2],
-        crop_size=None,
-        scale_factor=(0.85, 1.3),
-        bounding_box_format=tgt_bbox_format,
-    )
+    # Convert bboxes to their intended format on whole batches rather than on every image.
+    # This is skipped entirely when the formats already match.
+    if src_bbox_format != tgt_bbox_format:
 
-    train_dataset = train_dataset.map(
-        random_flip, num_parallel_calls=num_parallel_calls
-    ).map(jittered_resize, num_parallel_calls=num_parallel_calls)
+        # The splits share the same batched element signature, so this is traced once for all of them
+        @tf.function(input_signature=[datasets["test"].element_spec])
+        def batched_conversion_wrapper(inputs):
+            return convert_batched_bboxes(inputs, src_bbox_format, tgt_bbox_format)
+
+        datasets = {
+            split: dataset.map(
+                batched_conversion_wrapper, num_parallel_calls=num_parallel_calls
+            )
+            for split, dataset in datasets.items()
+        }
 
+    # Augmentations are applied by the model during training, see build_and_compile_detection
+    # The splits share the same batched element signature, so this is traced once for all of them
+    @tf.function(input_signature=[datasets["test"].element_spec])
     def conversion_wrapper(inputs):
         return convert_to_tuple(inputs, max_boxes=max_boxes)
 
-    train_dataset = train_dataset.map(
-        conversion_wrapper, num_parallel_calls=num_parallel_calls
-    )
-    val_dataset = val_dataset.map(
-        conversion_wrapper, num_parallel_calls=tf.data.AUTOTUNE
-    )
-    test_dataset = test_dataset.map(
-        conversion_wrapper, num_parallel_calls=tf.data.AUTOTUNE
-    )
-
-    # Fetch batches in the background while the model is training.
-    train_dataset = train_dataset.prefetch(buffer_size=prefetch_buffer_size)
-    val_dataset = val_dataset.prefetch(buffer_size=prefetch_buffer_size)
+    datasets = {
+        split: dataset.map(conversion_wrapper, num_parallel_calls=num_parallel_calls)
+        for split, dataset in datasets.items()
+    }
+
+    if use_dali:
+        # Decode, resize, and batch the training images on the GPU
+        train_dataset = create_dali_dataset(
+            filenames,
+            label_values,
+            coord_values,
+            bbox_row_lengths,
+            train_indices,
+            target_shape=target_shape,
+            max_boxes=max_boxes,
+            batch_size=min(batch_size, len(train_indices)),
+            seed=split_seed,
+        )
+    else:
+        # Fetch batches in the background while the model is training.
+        train_dataset = datasets["train"].prefetch(buffer_size=prefetch_buffer_size)
+    val_dataset = datasets["val"].prefetch(buffer_size=prefetch_buffer_size)
 
-    return train_dataset, val_dataset, test_dataset
+    return train_dataset, val_dataset, datasets["test"]
 
 
 # Build the Keras model for object detection
 def build_and_compile_detection(
-    num_classes: int, bounding_box_format: str, input_shape: ty.Tuple[int, int, int]
+    num_classes: int,
+    bounding_box_format: str,
+    input_shape: ty.Tuple[int, int, int],
+    max_boxes: int = 32,
 ) -> Model:
+    # Apply augmentations for that preserve bbox characteristics relative to image.
+    # These run inside the training step, so they execute on the training device rather than in the input pipeline.
+    augmenter = keras.Sequential(
+        layers=[
+            keras_cv.layers.RandomFlip(
+                mode="horizontal", bounding_box_format=bounding_box_format
+            ),
+            # This operation randomly rescales image with a RV from distribution defined by scale_factor,
+            # crops to crop_size, and then pads cropped image to input_shape
+            keras_cv.layers.JitteredResize(
+                target_size=input_shape[0:2],
+                crop_size=None,
+                scale_factor=(0.85, 1.3),
+                bounding_box_format=bounding_box_format,
+            ),
+        ]
+    )
     # Load the RetinaNet architecture with EfficientNet backbone
-    model = keras_cv.models.RetinaNet(
+    model = AugmentedRetinaNet(
+        augmenter=augmenter,
+        max_boxes=max_boxes,
         num_classes=num_classes,
         bounding_box_format=bounding_box_format,
         # Since the input images' pixel intensities are in the range [0, 255],
@@ -320,18 +764,35 @@ def build_and_compile_detection(
     return model
 
 
+def get_cache_path(
+    model_dir: str, num_images: int, target_shape: ty.Tuple[int, int, int]
+) -> str:
+    """Returns the path used to cache decoded images. An empty path caches in memory,
+    unless the decoded uint8 images would exceed IN_MEMORY_CACHE_LIMIT_BYTES.
+    Args:
+        model_dir: directory under which the on-disk cache is written
+        num_images: number of images in the dataset
+        target_shape: 3D shape of the decoded images
+    """
+    decoded_size = num_images * target_shape[0] * target_shape[1] * target_shape[2]
+    if decoded_size <= IN_MEMORY_CACHE_LIMIT_BYTES:
+        return ""
+    cache_dir = os.path.join(model_dir, "decoded_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, "decoded_cache")
+
+
 def save_labels(labels: ty.List[str], model_dir: str) -> None:
     filename = os.path.join(model_dir, labels_filename)
     with open(filename, "w") as f:
-        for label in labels[:-1]:
-            f.write(label + "\n")
-        f.write(labels[-1])
+        f.write("\n".join(labels))
 
 
 def preprocessing_layers_detection(
     target_shape: ty.Tuple[int, int, int] = (256, 256, 3),
 ) -> ty.Tuple[tf.Tensor, tf.Tensor]:
     """Preprocessing steps to apply to all images passed through the model.
+    Images of any size are letterboxed exactly like the training images, see parse_image_and_encode_bboxes.
     Args:
         target_shape: intended height and width of image
     """
@@ -340,14 +801,17 @@ def preprocessing_layers_detection(
         [
             # Resize to be (None, target_shape[0], target_shape[1], target_shape[2])
             # for compatibility with the RetinaNet model.
-            keras_cv.layers.Resizing(
-                target_shape[0],
-                target_shape[1],
-                crop_to_aspect_ratio=False,
-                # Pad to aspect ratio must be true for bounding boxes.
-                # This should not greatly affect the images,
-                # since we're attempting to preserve aspect ratio with the above calculation.
-                pad_to_aspect_ratio=True,
+            # The image is padded to preserve its aspect ratio and rounded, the same way as in training.
+            tf.keras.layers.Lambda(
+                lambda images: tf.round(
+                    tf.image.resize_with_pad(
+                        images,
+                        target_shape[0],
+                        target_shape[1],
+                        method=tf.image.ResizeMethod.BILINEAR,
+                        antialias=False,
+                    )
+                )
             ),
         ]
     )
@@ -359,10 +823,23 @@ def save_tflite_detection(
     model_dir: str,
     model_name: str,
     target_shape: ty.Tuple[int, int, int],
+    representative_dataset: tf.data.Dataset = None,
 ) -> None:
+    """Wraps the model with its preprocessing and prediction decoder and writes it as a TFLite model.
+    The TFLite model takes a uint8 image of any size, which it letterboxes to target_shape,
+    and returns bounding boxes relative to the original image.
+    Args:
+        model: trained detection model
+        model_dir: directory the TFLite model is written to
+        model_name: file name of the TFLite model, without extension
+        target_shape: 3D shape of the images the model was trained on
+        representative_dataset: optional batched dataset of (images, bounding_boxes) used to calibrate
+        int8 quantization of activations; if None, only the weights are quantized
+    """
     # Wrapping model here with the preprocessing step
     # This allows us to avoid overriding the custom compile function for RetinaNet
-    input = tf.keras.Input(target_shape, batch_size=1, dtype=tf.uint8)
+    # The height and width are dynamic, so that the letterbox in the preprocessing runs on the original image
+    input = tf.keras.Input((None, None, target_shape[2]), batch_size=1, dtype=tf.uint8)
     preprocessing = preprocessing_layers_detection(target_shape=target_shape)
     predictions = model(preprocessing(input), training=False)
     # Wrap output in prediction decoder, so it's in the dictionary format that we expect.
@@ -370,12 +847,29 @@ def save_tflite_detection(
     # we pass in a placeholder value of a tensor with ones with the intended batch and shape
     batched_prediction_placeholder = tf.ones((1,) + target_shape)
     output = model.decode_predictions(predictions, batched_prediction_placeholder)
+    # Map the boxes from the letterboxed image back onto the original image
+    output["boxes"] = tf.keras.layers.Lambda(
+        lambda inputs: unpad_rel_yxyx_bboxes(
+            inputs[0], tf.shape(inputs[1])[1:3], target_shape[0:2]
+        )
+    )([output["boxes"], input])
     wrapped_model = tf.keras.Model(inputs=input, outputs=output)
     # Convert the model to tflite
     converter = tf.lite.TFLiteConverter.from_keras_model(wrapped_model)
     converter.target_spec.supported_ops = TFLITE_OPS
     # Enable default optimization to quantize model
     converter.optimizations = TFLITE_OPTIMIZATIONS
+    if representative_dataset is not None:
+
+        def representative_images():
+            for image, _ in representative_dataset.unbatch().take(
+                REPRESENTATIVE_DATASET_SIZE
+            ):
+                yield [tf.expand_dims(tf.saturate_cast(image, tf.uint8), axis=0)]
+
+        # Calibrate activation ranges on real images, so that activations are quantized to int8 as well as weights
+        converter.representative_dataset = representative_images
+        converter.target_spec.supported_types = [tf.int8]
     tflite_model = converter.convert()
 
     filename = os.path.join(model_dir, f"{model_name}.tflite")
@@ -386,7 +880,8 @@ def save_tflite_detection(
 
 if __name__ == "__main__":
     # Set up compute device strategy
-    if len(tf.config.list_physical_devices("GPU")) > 0:
+    USE_GPU = len(tf.config.list_physical_devices("GPU")) > 0
+    if USE_GPU:
         strategy = tf.distribute.OneDeviceStrategy(device="/gpu:0")
     else:
         strategy = tf.distribute.OneDeviceStrategy(device="/cpu:0")
@@ -409,8 +904,24 @@ if __name__ == "__main__":
     # Model constants
     NUM_WORKERS = strategy.num_replicas_in_sync
     GLOBAL_BATCH_SIZE = BATCH_SIZE * NUM_WORKERS
+    TRAIN_SPLIT = 0.8
 
-    DATA_JSON, MODEL_DIR, num_epochs = parse_args()
+    (
+        DATA_JSON,
+        MODEL_DIR,
+        num_epochs,
+        TFRECORD_PREFIX,
+        SNAPSHOT_DIR,
+        use_dali,
+    ) = parse_args()
+    # Without a GPU, --use_dali is ignored and the training images are decoded on the CPU
+    USE_DALI = use_dali and USE_GPU
+    if USE_DALI and not dali_available():
+        raise ImportError("--use_dali requires nvidia-dali, see the dali extra")
+    if USE_DALI and GLOBAL_BATCH_SIZE < DALI_MIN_BATCH_SIZE:
+        warnings.warn(
+            f"Decoding on the GPU usually only pays off for batches of at least {DALI_MIN_BATCH_SIZE} images, got {GLOBAL_BATCH_SIZE}"
+        )
 
     EPOCHS = 200 if num_epochs is None or 0 else int(num_epochs)
     # Read dataset file, labels should be changed according to the desired model output.
@@ -418,41 +929,67 @@ if __name__ == "__main__":
     # Get filenames and bounding boxes of all images
     (
         image_filenames,
-        bbox_labels,
-        bbox_coords,
+        label_values,
+        coord_values,
+        bbox_row_lengths,
     ) = parse_filenames_and_bboxes_from_json(
         filename=DATA_JSON,
         all_labels=LABELS,
     )
+    CACHE_PATH = get_cache_path(MODEL_DIR, len(image_filenames), TARGET_SHAPE)
 
     # Generate 80/10/10 split for train, validation and test data
     train_dataset, val_dataset, test_dataset = create_dataset_detection(
         filenames=image_filenames,
-        classes=bbox_labels,
-        boxes=bbox_coords,
+        label_values=label_values,
+        coord_values=coord_values,
+        bbox_row_lengths=bbox_row_lengths,
         all_labels=LABELS,
         src_bbox_format=SRC_BBOX,
         tgt_bbox_format=TGT_BBOX,
         target_shape=TARGET_SHAPE,
-        train_split=0.8,
+        train_split=TRAIN_SPLIT,
         batch_size=GLOBAL_BATCH_SIZE,
         shuffle_buffer_size=SHUFFLE_BUFFER_SIZE,
         num_parallel_calls=AUTOTUNE,
         prefetch_buffer_size=AUTOTUNE,
+        cache_path=CACHE_PATH,
+        tfrecord_prefix=TFRECORD_PREFIX,
+        snapshot_path=SNAPSHOT_DIR,
+        use_dali=USE_DALI,
     )
 
     # Build and compile model
     with strategy.scope():
         model = build_and_compile_detection(len(LABELS), TGT_BBOX, TARGET_SHAPE)
 
-    # Train model on data
-    loss_history = model.fit(
-        x=train_dataset,
-        validation_data=val_dataset,
-        epochs=EPOCHS,
-    )
+    try:
+        # Train model on data
+        loss_history = model.fit(
+            x=train_dataset,
+            validation_data=val_dataset,
+            epochs=EPOCHS,
+            # The DALI training dataset never ends, so each epoch is a pass over the training split
+            steps_per_epoch=(
+                max(1, int(TRAIN_SPLIT * len(image_filenames)) // GLOBAL_BATCH_SIZE)
+                if USE_DALI
+                else None
+            ),
+        )
 
-    # Save labels.txt file
-    save_labels(LABELS, MODEL_DIR)
-    # Convert the model to tflite
-    save_tflite_detection(model, MODEL_DIR, "detection", TARGET_SHAPE)
+        # Save labels.txt file
+        save_labels(LABELS, MODEL_DIR)
+        # Convert the model to tflite, calibrating on the training split, which is fully cached after the first epoch
+        # and keeps the held-out test split unseen. The DALI training dataset can only be iterated on the GPU,
+        # so the validation split is used instead.
+        save_tflite_detection(
+            model,
+            MODEL_DIR,
+            "detection",
+            TARGET_SHAPE,
+            representative_dataset=val_dataset if USE_DALI else train_dataset,
+        )
+    finally:
+        # Remove the on-disk cache so it isn't uploaded alongside the model
+        if CACHE_PATH:
+            shutil.rmtree(os.path.dirname(CACHE_PATH), ignore_errors=True)
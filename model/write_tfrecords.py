@@ -0,0 +1,177 @@
+import argparse
+import typing as ty
+
+import numpy as np
+import orjson
+import tensorflow as tf
+from .training import (
+    SPLITS,
+    pack_annotations,
+    parse_filenames_and_bboxes_from_json,
+    parse_image_and_encode_bboxes,
+    slice_annotations,
+    split_indices,
+    tfrecord_metadata,
+    tfrecord_metadata_path,
+)
+
+# Shards are closed once they reach roughly this size
+SHARD_SIZE_BYTES = 256 * 1024**2
+
+
+def parse_args():
+    """Returns dataset file, output shard prefix, labels, image size, training split, and split seed. The shards are written to
+    files named <output_prefix>-<split>-<index>.tfrecord, which can be passed to training with --tfrecord_prefix.
+    The labels, image size, training split, and split seed are written to <output_prefix>-meta.json and must match the ones used for training.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_file", dest="data_json", type=str, required=True)
+    parser.add_argument(
+        "--output_prefix", dest="output_prefix", type=str, required=True
+    )
+    parser.add_argument("--labels", dest="labels", type=str, nargs="+", required=True)
+    parser.add_argument(
+        "--image_size", dest="img_size", type=int, nargs=2, default=[384, 384]
+    )
+    parser.add_argument("--train_split", dest="train_split", type=float, default=0.8)
+    parser.add_argument("--split_seed", dest="split_seed", type=int, default=0)
+    args = parser.parse_args()
+    return (
+        args.data_json,
+        args.output_prefix,
+        args.labels,
+        tuple(args.img_size),
+        args.train_split,
+        args.split_seed,
+    )
+
+
+def serialize_example(data: dict) -> bytes:
+    """Serializes a preprocessed observation into a tf.train.Example.
+    Args:
+        data: dictionary returned by parse_image_and_encode_bboxes
+    """
+    feature = {
+        "image": tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[data["images"].numpy().tobytes()])
+        ),
+        "boxes": tf.train.Feature(
+            float_list=tf.train.FloatList(
+                value=data["bounding_boxes"]["boxes"].numpy().reshape(-1)
+            )
+        ),
+        "classes": tf.train.Feature(
+            int64_list=tf.train.Int64List(
+                value=data["bounding_boxes"]["classes"].numpy()
+            )
+        ),
+    }
+    return tf.train.Example(
+        features=tf.train.Features(feature=feature)
+    ).SerializeToString()
+
+
+def write_shards(
+    dataset: tf.data.Dataset, output_prefix: str, shard_size_bytes: int
+) -> ty.List[str]:
+    """Writes preprocessed observations into TFRecord shards. Returns the shard paths.
+    Args:
+        dataset: dataset of dictionaries returned by parse_image_and_encode_bboxes
+        output_prefix: path prefix of the shards
+        shard_size_bytes: approximate size of each shard
+    """
+    shard_paths = []
+    writer = None
+    shard_bytes = 0
+    for data in dataset:
+        if writer is None or shard_bytes >= shard_size_bytes:
+            if writer is not None:
+                writer.close()
+            shard_paths.append(f"{output_prefix}-{len(shard_paths):05d}.tfrecord")
+            writer = tf.io.TFRecordWriter(shard_paths[-1])
+            shard_bytes = 0
+        example = serialize_example(data)
+        writer.write(example)
+        shard_bytes += len(example)
+    if writer is not None:
+        writer.close()
+    return shard_paths
+
+
+def write_tfrecords(
+    filenames: np.ndarray,
+    label_values: np.ndarray,
+    coord_values: np.ndarray,
+    bbox_row_lengths: np.ndarray,
+    all_labels: ty.List[str],
+    output_prefix: str,
+    img_size: ty.Tuple[int, int] = (256, 256),
+    train_split: float = 0.8,
+    split_seed: int = 0,
+    shard_size_bytes: int = SHARD_SIZE_BYTES,
+) -> ty.List[str]:
+    """Decodes and resizes every image once and writes the results into TFRecord shards for each split. Returns the shard paths.
+    Bounding boxes are stored in their source format and converted during training. The labels, image size, and split
+    are written next to the shards, so that training can check that it reads the shards with the same ones.
+    Args:
+        filenames: string array of image paths
+        label_values: int32 array of the encoded labels of all bboxes
+        coord_values: float32 array of shape [num_bboxes, 4] with the coordinates of all bboxes
+        bbox_row_lengths: int32 array with the number of bboxes of each image
+        all_labels: list of all labels the classes are encoded against
+        output_prefix: path prefix of the shards
+        img_size: intended height and width of the images
+        train_split: float between 0.0 and 1.0 to specify proportion of images that will be used for training
+        split_seed: seed of the shuffle that assigns images to the splits, which must match the one used for training
+        shard_size_bytes: approximate size of each shard
+    """
+    with open(tfrecord_metadata_path(output_prefix), "wb") as f:
+        f.write(
+            orjson.dumps(
+                tfrecord_metadata(
+                    len(filenames), all_labels, img_size, train_split, split_seed
+                )
+            )
+        )
+    classes, boxes = pack_annotations(label_values, coord_values, bbox_row_lengths)
+    shard_paths = []
+    for split, indices in zip(
+        SPLITS, split_indices(len(filenames), train_split, split_seed)
+    ):
+        dataset = slice_annotations(
+            filenames[indices],
+            tf.gather(classes, indices),
+            tf.gather(boxes, indices),
+        ).map(
+            lambda x: parse_image_and_encode_bboxes(x, img_size),
+            num_parallel_calls=tf.data.AUTOTUNE,
+        )
+        shard_paths += write_shards(
+            dataset, f"{output_prefix}-{split}", shard_size_bytes
+        )
+    return shard_paths
+
+
+if __name__ == "__main__":
+    DATA_JSON, OUTPUT_PREFIX, LABELS, IMG_SIZE, TRAIN_SPLIT, SPLIT_SEED = parse_args()
+
+    (
+        image_filenames,
+        label_values,
+        coord_values,
+        bbox_row_lengths,
+    ) = parse_filenames_and_bboxes_from_json(
+        filename=DATA_JSON,
+        all_labels=LABELS,
+    )
+    write_tfrecords(
+        filenames=image_filenames,
+        label_values=label_values,
+        coord_values=coord_values,
+        bbox_row_lengths=bbox_row_lengths,
+        all_labels=LABELS,
+        output_prefix=OUTPUT_PREFIX,
+        img_size=IMG_SIZE,
+        train_split=TRAIN_SPLIT,
+        split_seed=SPLIT_SEED,
+    )
@@ -10,7 +10,12 @@ setup(
         "keras==2.14.0",
         "keras-cv==0.5.1",
         "Keras-Preprocessing==1.1.2",
+        "orjson",
         "tflite-support",
     ],
+    extras_require={
+        # Decodes training images on the GPU with --use_dali
+        "dali": ["nvidia-dali-cuda120"],
+    },
     include_package_data=True,
 )
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from model.dali_pipeline import create_dali_dataset, pad_annotations
+
+
+def test_pad_annotations():
+    boxes, classes = pad_annotations(
+        label_values=np.array([1, 0, 1], dtype=np.int32),
+        coord_values=np.array(
+            [[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4], [0.5, 0.5, 0.6, 0.6]],
+            dtype=np.float32,
+        ),
+        bbox_row_lengths=np.array([2, 0, 1], dtype=np.int32),
+        indices=np.array([2, 0, 1]),
+        max_boxes=3,
+    )
+    np.testing.assert_array_equal(classes, [[1, -1, -1], [1, 0, -1], [-1, -1, -1]])
+    np.testing.assert_allclose(boxes[0, 0], [0.5, 0.5, 0.6, 0.6])
+    np.testing.assert_allclose(
+        boxes[1, :2], [[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4]]
+    )
+    np.testing.assert_array_equal(boxes[0, 1:], -1)
+    np.testing.assert_array_equal(boxes[2], -1)
+
+
+def test_create_dali_dataset(tmp_path):
+    pytest.importorskip("nvidia.dali")
+    if not tf.config.list_physical_devices("GPU"):
+        pytest.skip("Decoding with DALI requires a GPU")
+    filenames = []
+    for i, image_size in enumerate([(100, 300), (200, 100)]):
+        path = tmp_path / f"{i}.jpg"
+        path.write_bytes(
+            tf.io.encode_jpeg(
+                tf.fill(image_size + (3,), tf.constant(255, tf.uint8))
+            ).numpy()
+        )
+        filenames.append(str(path))
+
+    dataset = create_dali_dataset(
+        np.array(filenames, dtype=str),
+        label_values=np.array([1, 0], dtype=np.int32),
+        coord_values=np.array(
+            [[0.0, 0.0, 1.0, 1.0], [0.0, 0.0, 1.0, 1.0]], dtype=np.float32
+        ),
+        bbox_row_lengths=np.array([1, 1], dtype=np.int32),
+        indices=np.array([0, 1]),
+        target_shape=(64, 64, 3),
+        max_boxes=2,
+        batch_size=2,
+    )
+    images, bounding_boxes = next(iter(dataset))
+    assert images.shape == (2, 64, 64, 3)
+    assert images.dtype == tf.float32
+    for image, boxes, classes in zip(
+        images.numpy(),
+        bounding_boxes["boxes"].numpy(),
+        bounding_boxes["classes"].numpy(),
+    ):
+        # The box around the whole image lands on the region that isn't padding
+        rows = np.nonzero(image[:, :, 0].any(axis=1))[0]
+        cols = np.nonzero(image[:, :, 0].any(axis=0))[0]
+        np.testing.assert_allclose(
+            boxes[0] * 64, [rows[0], cols[0], rows[-1] + 1, cols[-1] + 1], atol=1
+        )
+        np.testing.assert_array_equal(boxes[1], -1)
+        assert classes[1] == -1
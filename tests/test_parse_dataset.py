@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+from model.training import parse_filenames_and_bboxes_from_json
+
+
+def annotation(label, y_min, x_min, y_max, x_max):
+    return {
+        "annotation_label": label,
+        "y_min_normalized": y_min,
+        "x_min_normalized": x_min,
+        "y_max_normalized": y_max,
+        "x_max_normalized": x_max,
+    }
+
+
+def test_parse_filenames_and_bboxes_from_json(tmp_path):
+    dataset_file = tmp_path / "dataset.jsonl"
+    lines = [
+        {
+            "image_path": "a.jpg",
+            "bounding_box_annotations": [
+                annotation("blue_star", 0.1, 0.2, 0.3, 0.4),
+                annotation("unknown", 0.0, 0.0, 1.0, 1.0),
+                annotation("orange_triangle", 0.5, 0.6, 0.7, 0.8),
+            ],
+        },
+        {"image_path": "b.jpg", "bounding_box_annotations": []},
+        {
+            "image_path": "c.jpg",
+            "bounding_box_annotations": [annotation("blue_star", 0.0, 0.1, 0.2, 0.3)],
+        },
+    ]
+    dataset_file.write_text("\n".join(json.dumps(line) for line in lines))
+
+    (
+        filenames,
+        label_values,
+        coord_values,
+        bbox_row_lengths,
+    ) = parse_filenames_and_bboxes_from_json(
+        str(dataset_file), ["orange_triangle", "blue_star"]
+    )
+
+    assert filenames.tolist() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert label_values.dtype == np.int32
+    assert label_values.tolist() == [1, 0, 1]
+    assert bbox_row_lengths.dtype == np.int32
+    assert bbox_row_lengths.tolist() == [2, 0, 1]
+    assert coord_values.dtype == np.float32
+    np.testing.assert_allclose(
+        coord_values,
+        [[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.7, 0.8], [0.0, 0.1, 0.2, 0.3]],
+    )
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from model.training import (
+    decode_jpeg_at_scale,
+    pad_rel_yxyx_bboxes,
+    unpad_rel_yxyx_bboxes,
+)
+
+
+@pytest.mark.parametrize(
+    "image_size",
+    [
+        (200, 100),  # portrait, padded left and right
+        (100, 300),  # landscape, padded top and bottom
+    ],
+)
+def test_pad_rel_yxyx_bboxes(image_size):
+    img_size = (64, 64)
+    image = tf.ones(image_size + (3,), dtype=tf.float32)
+    padded = tf.image.resize_with_pad(image, img_size[0], img_size[1]).numpy()
+    rows = np.nonzero(padded[:, :, 0].any(axis=1))[0]
+    cols = np.nonzero(padded[:, :, 0].any(axis=0))[0]
+
+    # A box around the whole image must land exactly on the region that resize_with_pad filled
+    boxes = pad_rel_yxyx_bboxes(
+        tf.constant([[0.0, 0.0, 1.0, 1.0]]), tf.constant(image_size), img_size
+    )
+    np.testing.assert_allclose(
+        boxes.numpy()[0] * [img_size[0], img_size[1], img_size[0], img_size[1]],
+        [rows[0], cols[0], rows[-1] + 1, cols[-1] + 1],
+        atol=1e-4,
+    )
+
+
+@pytest.mark.parametrize("image_size", [(200, 100), (100, 300)])
+def test_unpad_rel_yxyx_bboxes(image_size):
+    boxes = tf.constant([[0.1, 0.2, 0.5, 0.9], [0.0, 0.0, 1.0, 1.0]])
+    padded = pad_rel_yxyx_bboxes(boxes, tf.constant(image_size), (64, 64))
+    np.testing.assert_allclose(
+        unpad_rel_yxyx_bboxes(padded, tf.constant(image_size), (64, 64)).numpy(),
+        boxes.numpy(),
+        atol=1e-5,
+    )
+    # Boxes in the padding are clipped to the original image
+    np.testing.assert_allclose(
+        unpad_rel_yxyx_bboxes(
+            tf.constant([[0.0, 0.0, 1.0, 1.0]]), tf.constant(image_size), (64, 64)
+        ).numpy(),
+        [[0.0, 0.0, 1.0, 1.0]],
+    )
+
+
+@pytest.mark.parametrize(
+    "image_size, expected_shape",
+    [
+        ((150, 150), (150, 150)),  # less than twice the target, decoded at full size
+        ((300, 300), (150, 150)),  # ratio 2
+        ((400, 900), (100, 225)),  # ratio 4, limited by the height
+        ((800, 1000), (100, 125)),  # ratio 8
+    ],
+)
+def test_decode_jpeg_at_scale(image_size, expected_shape):
+    jpeg = tf.io.encode_jpeg(tf.zeros(image_size + (3,), dtype=tf.uint8))
+    image = decode_jpeg_at_scale(jpeg, (100, 100))
+    assert tuple(image.shape) == expected_shape + (3,)
+    assert image.dtype == tf.uint8
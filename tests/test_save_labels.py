@@ -0,0 +1,11 @@
+from model.training import labels_filename, save_labels
+
+
+def test_save_labels(tmp_path):
+    save_labels(["orange_triangle", "blue_star"], str(tmp_path))
+    assert (tmp_path / labels_filename).read_text() == "orange_triangle\nblue_star"
+
+
+def test_save_single_label(tmp_path):
+    save_labels(["blue_star"], str(tmp_path))
+    assert (tmp_path / labels_filename).read_text() == "blue_star"
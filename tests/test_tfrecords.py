@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from model.training import (
+    check_tfrecord_metadata,
+    parse_tfrecord_example,
+    tfrecord_metadata,
+    tfrecord_metadata_path,
+)
+from model.write_tfrecords import serialize_example
+
+
+def test_serialize_and_parse_example():
+    image = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+    boxes = np.array([[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.7, 0.8]], dtype=np.float32)
+    classes = np.array([1, 0], dtype=np.int32)
+    example = serialize_example(
+        {
+            "images": tf.constant(image),
+            "bounding_boxes": {
+                "boxes": tf.constant(boxes),
+                "classes": tf.constant(classes),
+            },
+        }
+    )
+
+    parsed = parse_tfrecord_example(tf.constant(example), img_size=(4, 5))
+    assert parsed["images"].dtype == tf.uint8
+    np.testing.assert_array_equal(parsed["images"].numpy(), image)
+    np.testing.assert_array_equal(parsed["bounding_boxes"]["boxes"].numpy(), boxes)
+    assert parsed["bounding_boxes"]["classes"].dtype == tf.int32
+    np.testing.assert_array_equal(parsed["bounding_boxes"]["classes"].numpy(), classes)
+
+
+def test_check_tfrecord_metadata(tmp_path):
+    prefix = str(tmp_path / "shards")
+    with open(tfrecord_metadata_path(prefix), "wb") as f:
+        f.write(
+            b'{"num_images":10,"labels":["orange_triangle","blue_star"],'
+            b'"image_size":[384,384],"train_split":0.8,"split_seed":0}'
+        )
+    check_tfrecord_metadata(
+        prefix, 10, ["orange_triangle", "blue_star"], (384, 384), 0.8, 0
+    )
+    with pytest.raises(ValueError, match="num_images"):
+        check_tfrecord_metadata(
+            prefix, 12, ["orange_triangle", "blue_star"], (384, 384), 0.8, 0
+        )
+    with pytest.raises(ValueError, match="labels"):
+        check_tfrecord_metadata(
+            prefix, 10, ["blue_star", "orange_triangle"], (384, 384), 0.8, 0
+        )
+    with pytest.raises(ValueError, match="image_size"):
+        check_tfrecord_metadata(
+            prefix, 10, ["orange_triangle", "blue_star"], (256, 256), 0.8, 0
+        )
+
+
+def test_tfrecord_metadata_matches_json():
+    assert tfrecord_metadata(10, ("a", "b"), (384, 256), 0.8, 1) == {
+        "num_images": 10,
+        "labels": ["a", "b"],
+        "image_size": [384, 256],
+        "train_split": 0.8,
+        "split_seed": 1,
+    }